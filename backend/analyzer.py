@@ -4,13 +4,106 @@ Identifies advertisements in newspaper page images.
 """
 
 import anthropic
+import asyncio
 import base64
+import functools
+import math
+import os
+import random
+import time
 from pathlib import Path
-from dataclasses import dataclass
+from dataclasses import dataclass, asdict
+from typing import Callable
 from dotenv import load_dotenv
 
+import analyzer_cache
+
 load_dotenv('.env.local')
 
+MODEL = "claude-sonnet-4-20250514"
+
+# Requests in flight at once; keep under the account's concurrent-request limit
+MAX_CONCURRENCY = int(os.environ.get("ANALYZE_CONCURRENCY", "5"))
+
+# Pages sent together in one request. The system prompt is paid once per
+# request, so batching cuts prompt tokens and RPM; 1 sends pages one by one.
+PAGES_PER_REQUEST = int(os.environ.get("ANALYZE_BATCH_SIZE", "3"))
+
+# Budget at ~80% of the account's tier limits so bursts don't trip 429s
+REQUESTS_PER_MINUTE = int(os.environ.get("ANTHROPIC_RPM", "40"))
+INPUT_TOKENS_PER_MINUTE = int(os.environ.get("ANTHROPIC_ITPM", "24000"))
+
+# Retries for 429 (rate limited), 529 (overloaded) and other transient errors
+MAX_RETRIES = 5
+
+# Bump when the prompt or response format changes to invalidate cached results
+PROMPT_VERSION = "v4"
+
+# Longest edge sent to Claude; larger images are downscaled server-side anyway
+MAX_IMAGE_EDGE = 1568
+
+# Claude's vision preprocessing gains nothing from higher quality; matches the
+# quality db.upload_page_image uses for stored page images
+JPEG_QUALITY = 85
+
+# Optional local prefilter (see likely_has_ads). An eighth-page ad covers ~12%
+# of the page; the threshold leaves room for strips and banners.
+PREFILTER_MIN_AREA = 0.05
+PREFILTER_MAX_EDGE = 1600
+
+AD_LIST_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "advertiser": {"type": "string"},
+            "description": {"type": "string"},
+            "location": {"type": "string"},
+            "size": {
+                "type": "string",
+                "enum": ["full page", "half page", "quarter page",
+                         "eighth page", "strip/banner", "classified"]
+            },
+            "confidence": {"type": "string", "enum": ["high", "medium", "low"]}
+        },
+        "required": ["advertiser"]
+    }
+}
+
+# Claude reports ads by calling this tool, so the reply is already structured
+RECORD_ADS_TOOL = {
+    "name": "record_ads",
+    "description": "Record the paid advertisements found on the newspaper page.",
+    "input_schema": {
+        "type": "object",
+        "properties": {"ads": AD_LIST_SCHEMA},
+        "required": ["ads"]
+    }
+}
+
+# Multi-page variant: one entry per page, matched back up by page_index
+RECORD_PAGE_ADS_TOOL = {
+    "name": "record_page_ads",
+    "description": "Record the paid advertisements found on each newspaper page.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "pages": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "page_index": {"type": "integer"},
+                        "ads": AD_LIST_SCHEMA
+                    },
+                    "required": ["page_index", "ads"]
+                }
+            }
+        },
+        "required": ["pages"]
+    }
+}
+
 
 @dataclass
 class AdInfo:
@@ -22,57 +115,221 @@ class AdInfo:
     confidence: str  # "high", "medium", "low"
 
 
-def encode_image(image_path: Path, max_size_mb: float = 4.5) -> str:
-    """Encode image to base64 for Claude API, resizing if too large."""
+class RateLimiter:
+    """Token bucket for requests/minute and input tokens/minute.
+
+    Both buckets start full and refill continuously; acquire() waits until
+    one request and the estimated input tokens are available.
+    """
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    async def acquire(self, tokens: int):
+        """Wait for capacity to send one request of roughly `tokens` input tokens."""
+        # A request bigger than the whole bucket would otherwise wait forever
+        tokens = min(tokens, self.tpm)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                wait = max((1 - self._requests) * 60 / self.rpm,
+                           (tokens - self._tokens) * 60 / self.tpm)
+                await asyncio.sleep(wait)
+
+
+def estimate_input_tokens(image_paths: Path | list[Path], prompt: str) -> int:
+    """Rough input token count for a request with one or more page images."""
+    if isinstance(image_paths, Path):
+        image_paths = [image_paths]
+    return sum(_image_tokens(p) for p in image_paths) + len(prompt) // 4
+
+
+def _image_tokens(image_path: Path) -> int:
     from PIL import Image
-    import io
 
-    img = Image.open(image_path)
+    # Only reads the header, not the pixel data
+    with Image.open(image_path) as img:
+        width, height = img.size
+
+    # Anthropic bills ~(width * height) / 750 per image, capped near 1600
+    # because larger images are downscaled server-side
+    return min(width * height // 750, 1600)
+
+
+def _retry_delay(error: Exception, delay: float) -> float:
+    """Seconds to wait before retrying, honoring Retry-After when present."""
+    retry_after = None
+    if isinstance(error, anthropic.APIStatusError):
+        retry_after = error.response.headers.get("retry-after")
+    try:
+        delay = max(delay, float(retry_after))
+    except (TypeError, ValueError):
+        pass
+    return delay * random.uniform(1.0, 1.25)
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, anthropic.APIConnectionError):
+        return True
+    if isinstance(error, anthropic.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+async def create_message(client: anthropic.AsyncAnthropic, request: dict,
+                         limiter: RateLimiter = None, est_tokens: int = 0):
+    """Call messages.create, waiting on the rate limiter and backing off on 429/529."""
+    delay = 1.0
+    for attempt in range(MAX_RETRIES + 1):
+        if limiter:
+            await limiter.acquire(est_tokens)
+        try:
+            return await client.messages.create(**request)
+        except Exception as e:
+            if not _is_retryable(e) or attempt == MAX_RETRIES:
+                raise
+            wait = _retry_delay(e, delay)
+            print(f"  API error ({e.__class__.__name__}), retrying in {wait:.1f}s...")
+            await asyncio.sleep(wait)
+            delay *= 2
+
 
-    if img.mode in ('RGBA', 'P'):
-        img = img.convert('RGB')
+@functools.lru_cache(maxsize=1)
+def get_anthropic() -> anthropic.Anthropic:
+    """Shared synchronous client, so repeated calls reuse one connection pool."""
+    return anthropic.Anthropic()
 
-    buffer = io.BytesIO()
-    img.save(buffer, format='JPEG', quality=95)
-    size_mb = len(buffer.getvalue()) / (1024 * 1024)
 
-    while size_mb > max_size_mb:
-        new_width = int(img.width * 0.8)
-        new_height = int(img.height * 0.8)
-        img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+def encode_image(image_path: Path, max_size_mb: float = 4.5) -> str:
+    """Encode image to base64 for Claude API, resizing if too large."""
+    import cv2
+
+    # ANYCOLOR keeps grayscale scans single-channel and turns RGBA/palette PNGs
+    # into BGR, so no separate mode conversion is needed
+    img = cv2.imread(str(image_path), cv2.IMREAD_ANYCOLOR)
+    if img is None:
+        raise ValueError(f"Could not read image: {image_path}")
+
+    # Claude downsamples anything over ~1568px on the long edge before the model
+    # sees it, so extra pixels only cost upload bytes
+    height, width = img.shape[:2]
+    scale = min(1.0, MAX_IMAGE_EDGE / max(width, height))
+    if scale < 1.0:
+        img = cv2.resize(img, (round(width * scale), round(height * scale)),
+                         interpolation=_interpolation(scale))
+
+    buf = _encode_jpeg(img)
+    size_mb = buf.nbytes / (1024 * 1024)
+
+    # Rarely needed after the downscale above; kept as a safety net
+    if size_mb > max_size_mb:
+        # JPEG size scales roughly with pixel count, so a single resample to the
+        # computed scale usually lands under the limit. Retry at most twice more.
+        height, width = img.shape[:2]
+        scale = 1.0
+        for _ in range(3):
+            scale *= math.sqrt(max_size_mb * 0.95 / size_mb)
+            resized = cv2.resize(img, (int(width * scale), int(height * scale)),
+                                 interpolation=_interpolation(scale))
+            buf = _encode_jpeg(resized)
+            size_mb = buf.nbytes / (1024 * 1024)
+            if size_mb <= max_size_mb:
+                break
+
+    # b64encode reads the numpy buffer directly (no tobytes() copy), and
+    # base64 output is pure ASCII so the cheaper codec is safe
+    return base64.b64encode(buf).decode("ascii")
+
+
+def _interpolation(scale: float) -> int:
+    """OpenCV resize filter for a scale factor.
+
+    Area averaging is the correct filter for shrinking and is cheaper than
+    Lanczos, which also rings on high-contrast edges like newspaper text.
+    Lanczos is kept for enlarging.
+    """
+    import cv2
 
-        buffer = io.BytesIO()
-        img.save(buffer, format='JPEG', quality=90)
-        size_mb = len(buffer.getvalue()) / (1024 * 1024)
+    return cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LANCZOS4
 
-    return base64.standard_b64encode(buffer.getvalue()).decode("utf-8")
 
+def _encode_jpeg(img, quality: int = JPEG_QUALITY):
+    """JPEG-encode an image array with OpenCV, returning the encoded buffer."""
+    import cv2
 
-def analyze_page(image_path: Path, clients: list[str] = None) -> list[AdInfo]:
-    """
-    Analyze a newspaper page image to find advertisements.
+    # Optimized Huffman tables shave a few percent for negligible CPU;
+    # progressive mode only adds bytes at these sizes
+    params = [int(cv2.IMWRITE_JPEG_QUALITY), quality,
+              int(cv2.IMWRITE_JPEG_OPTIMIZE), 1,
+              int(cv2.IMWRITE_JPEG_PROGRESSIVE), 0]
+    ok, buf = cv2.imencode(".jpg", img, params)
+    if not ok:
+        raise ValueError("JPEG encoding failed")
+    return buf
 
-    Args:
-        image_path: Path to the page image
-        clients: Optional list of client names to specifically look for
 
-    Returns:
-        List of AdInfo objects describing each ad found
+def likely_has_ads(image_path: Path, min_area: float = PREFILTER_MIN_AREA) -> bool:
     """
-    client = anthropic.Anthropic()
+    Cheap local check for whether a page could contain display ads.
 
-    image_data = encode_image(image_path)
+    Looks for box-like edge regions covering at least min_area of the page,
+    which ads (bordered blocks) produce and plain text columns do not. A
+    region only counts if its edges run along all four sides of its bounding
+    box, so column rules joined to a headline rule don't pass as a box.
+    Photos also pass, so this only rules out pages that are clearly text.
+    """
+    import cv2
 
-    client_context = ""
-    if clients:
-        client_context = f"""
-Pay special attention to ads from these clients (case-insensitive):
-{chr(10).join(f'- {c}' for c in clients)}
+    img = cv2.imread(str(image_path), cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        raise ValueError(f"Could not read image: {image_path}")
 
-If you find any ads from these specific clients, make sure to note them clearly.
-"""
+    # Box detection doesn't need full resolution
+    scale = PREFILTER_MAX_EDGE / max(img.shape)
+    if scale < 1.0:
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    edges = cv2.Canny(img, 50, 150)
+    _, labels, stats, _ = cv2.connectedComponentsWithStats(edges, connectivity=8)
+
+    page_area = img.shape[0] * img.shape[1]
+    # Row 0 is the background component
+    for label, (x, y, width, height, _) in enumerate(stats[1:], start=1):
+        if width * height / page_area < min_area:
+            continue
+        if not 1 / 12 <= width / height <= 12:
+            continue
+        if _outlines_box(labels[y:y + height, x:x + width] == label):
+            return True
+    return False
 
-    prompt = f"""Analyze this newspaper page image and identify all PAID ADVERTISEMENTS.
+
+def _outlines_box(mask, band: int = 3, min_coverage: float = 0.8) -> bool:
+    """Whether a component (mask cropped to its bounding box) runs along all four sides."""
+    sides = (mask[:band].any(axis=0), mask[-band:].any(axis=0),
+             mask[:, :band].any(axis=1), mask[:, -band:].any(axis=1))
+    return all(side.mean() >= min_coverage for side in sides)
+
+
+# Static part of the prompt: identical for every page and every run. Must not
+# contain dates, page numbers or anything else that would break prompt caching.
+AD_PROMPT = """Analyze this newspaper page image and identify all PAID ADVERTISEMENTS.
 
 CRITICAL RULES:
 - A paid ad MUST contain a call to action or response mechanism: a website URL, phone number, QR code, physical address, "visit us", "call now", coupon code, or similar lead-generation text. If there is no way for a reader to respond or take action, it is NOT a paid ad.
@@ -92,104 +349,384 @@ For each advertisement, provide:
 4. Size (use standard sizes: "full page", "half page", "quarter page", "eighth page", "strip/banner", "classified")
 5. Confidence level (high/medium/low)
 
-{client_context}
+Record every paid ad with the tool provided. If there are no paid ads on a page, record an empty list for it.
+"""
+
 
-If there are no paid ads on this page, say "No advertisements found."
+def build_client_context(clients: list[str] = None) -> str:
+    """Prompt suffix listing clients to watch for (empty if none)."""
+    if not clients:
+        return ""
+    return f"""Pay special attention to ads from these clients (case-insensitive):
+{chr(10).join(f'- {c}' for c in clients)}
 
-Respond in this exact format for each ad:
----
-ADVERTISER: [company name]
-DESCRIPTION: [what they're advertising]
-LOCATION: [where on page]
-SIZE: [ad size]
-CONFIDENCE: [high/medium/low]
----
+If you find any ads from these specific clients, make sure to note them clearly.
 """
 
-    response = client.messages.create(
-        model="claude-sonnet-4-20250514",
-        max_tokens=4096,
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "image",
-                        "source": {
-                            "type": "base64",
-                            "media_type": "image/jpeg",
-                            "data": image_data,
-                        }
-                    },
-                    {
-                        "type": "text",
-                        "text": prompt
-                    }
-                ]
-            }
-        ]
-    )
 
-    return parse_ad_response(response.content[0].text)
+def build_prompt(clients: list[str] = None) -> str:
+    """Full prompt text (static rules + client list), used for cache keys and token estimates."""
+    return AD_PROMPT + build_client_context(clients)
+
+
+def build_system(clients: list[str] = None) -> list[dict]:
+    """System prompt blocks, with a cache breakpoint on the last one."""
+    # Instructions and client list are the same for every page of a run, so
+    # they go in the system prompt where they can be cached. Only the page
+    # images vary, in the user message.
+    system = [{"type": "text", "text": AD_PROMPT}]
+    client_context = build_client_context(clients)
+    if client_context:
+        system.append({"type": "text", "text": client_context})
+    system[-1]["cache_control"] = {"type": "ephemeral"}
+    return system
+
+
+def _image_block(image_data: str) -> dict:
+    return {
+        "type": "image",
+        "source": {
+            "type": "base64",
+            "media_type": "image/jpeg",
+            "data": image_data,
+        }
+    }
+
+
+def build_request(image_data: str, clients: list[str] = None) -> dict:
+    """Build the messages.create() arguments for one page image."""
+    return {
+        "model": MODEL,
+        "max_tokens": 2048,
+        "tools": [RECORD_ADS_TOOL],
+        "tool_choice": {"type": "tool", "name": "record_ads"},
+        "system": build_system(clients),
+        "messages": [{
+            "role": "user",
+            "content": [_image_block(image_data)]
+        }]
+    }
+
+
+def build_batch_request(images: list[str], clients: list[str] = None) -> dict:
+    """Build the messages.create() arguments for several page images at once."""
+    # Label each image so Claude can report pages by index
+    content = []
+    for index, image_data in enumerate(images):
+        content.append({"type": "text", "text": f"Page {index}:"})
+        content.append(_image_block(image_data))
+    content.append({"type": "text", "text": (
+        f"These are {len(images)} separate newspaper pages. Apply the rules to each "
+        f"page on its own and call record_page_ads once, with one entry per page "
+        f"(page_index 0 to {len(images) - 1}), including pages with no ads."
+    )})
+
+    return {
+        "model": MODEL,
+        "max_tokens": 2048 * len(images),
+        "tools": [RECORD_PAGE_ADS_TOOL],
+        "tool_choice": {"type": "tool", "name": "record_page_ads"},
+        "system": build_system(clients),
+        "messages": [{"role": "user", "content": content}]
+    }
+
+
+def _key_parts(clients: list[str], prefilter: bool, batched: bool = False) -> list[str]:
+    """Everything besides the image that determines a page's cached result."""
+    parts = [build_prompt(clients), MODEL]
+    # A prefiltered run can return [] without asking Claude, so keep it separate
+    if prefilter:
+        parts.append(f"prefilter:{PREFILTER_MIN_AREA}")
+    # Answers from multi-page requests aren't the same as single-page ones
+    if batched:
+        parts.append(RECORD_PAGE_ADS_TOOL["name"])
+    return parts
+
+
+def _page_keys(image_path: Path, clients: list[str], prefilter: bool) -> list[str] | None:
+    """[single-page key, multi-page key] for a page, or None if caching is off.
+
+    Hashes the image once for both keys.
+    """
+    if not analyzer_cache.is_enabled():
+        return None
+    return analyzer_cache.cache_keys(image_path,
+                                     _key_parts(clients, prefilter),
+                                     _key_parts(clients, prefilter, batched=True))
+
 
+def _read_ads(keys: list[str] | None, batched: bool = False) -> list[AdInfo] | None:
+    """Cached ads for a page, or None on a miss.
 
-def parse_ad_response(response_text: str) -> list[AdInfo]:
-    """Parse Claude's response into AdInfo objects."""
-    ads = []
+    A batched run accepts either kind of result; a single-page lookup only
+    its own, since the two requests can answer differently.
+    """
+    if keys is None:
+        return None
+    for key in keys if batched else keys[:1]:
+        entry = analyzer_cache.read(key, PROMPT_VERSION)
+        if entry is not None:
+            return [AdInfo(**a) for a in entry["ads"]]
+    return None
+
+
+def _write_ads(keys: list[str] | None, ads: list[AdInfo], batched: bool = False):
+    """Cache a page's ads under the key for the kind of request that found them."""
+    if keys is None:
+        return
+    analyzer_cache.write(keys[1 if batched else 0], PROMPT_VERSION,
+                         {"model": MODEL, "ads": [asdict(ad) for ad in ads]})
+
+
+def analyze_page(image_path: Path, clients: list[str] = None, *,
+                 client: anthropic.Anthropic = None,
+                 prefilter: bool = False) -> list[AdInfo]:
+    """
+    Analyze a newspaper page image to find advertisements.
+
+    Args:
+        image_path: Path to the page image
+        clients: Optional list of client names to specifically look for
+        client: Anthropic client to use; defaults to the shared get_anthropic()
+        prefilter: Skip the API call for pages likely_has_ads() rules out
 
-    if "no advertisements found" in response_text.lower():
+    Returns:
+        List of AdInfo objects describing each ad found
+    """
+    keys = _page_keys(image_path, clients, prefilter)
+    ads = _read_ads(keys)
+    if ads is not None:
         return ads
 
-    sections = response_text.split('---')
+    if prefilter and not likely_has_ads(image_path):
+        ads = []
+    else:
+        client = client or get_anthropic()
+        image_data = encode_image(image_path)
+        response = client.messages.create(**build_request(image_data, clients))
+        ads = ads_from_response(response)
 
-    current_ad = {}
-    for section in sections:
-        section = section.strip()
-        if not section:
-            continue
+    _write_ads(keys, ads)
+    return ads
 
-        lines = section.split('\n')
-        for line in lines:
-            line = line.strip()
-            if line.startswith('ADVERTISER:'):
-                current_ad['advertiser'] = line.replace('ADVERTISER:', '').strip()
-            elif line.startswith('DESCRIPTION:'):
-                current_ad['description'] = line.replace('DESCRIPTION:', '').strip()
-            elif line.startswith('LOCATION:'):
-                current_ad['location'] = line.replace('LOCATION:', '').strip()
-            elif line.startswith('SIZE:'):
-                current_ad['size'] = line.replace('SIZE:', '').strip()
-            elif line.startswith('CONFIDENCE:'):
-                current_ad['confidence'] = line.replace('CONFIDENCE:', '').strip()
-
-        if current_ad.get('advertiser'):
-            ads.append(AdInfo(
-                advertiser=current_ad.get('advertiser', 'Unknown'),
-                description=current_ad.get('description', ''),
-                location=current_ad.get('location', ''),
-                size=current_ad.get('size', ''),
-                confidence=current_ad.get('confidence', 'medium')
-            ))
-            current_ad = {}
 
+async def analyze_page_async(client: anthropic.AsyncAnthropic, image_path: Path,
+                             clients: list[str] = None,
+                             limiter: RateLimiter = None,
+                             prefilter: bool = False) -> list[AdInfo]:
+    """Async version of analyze_page using a shared AsyncAnthropic client."""
+    # Hashing and the prefilter read the whole image; keep them off the event loop
+    keys = await asyncio.to_thread(_page_keys, image_path, clients, prefilter)
+    ads = _read_ads(keys)
+    if ads is not None:
+        return ads
+
+    if prefilter and not await asyncio.to_thread(likely_has_ads, image_path):
+        ads = []
+    else:
+        ads = await _request_page_ads(client, image_path, clients, limiter)
+
+    _write_ads(keys, ads)
     return ads
 
 
-def analyze_edition(edition_dir: Path, clients: list[str] = None) -> dict[str, list[AdInfo]]:
-    """Analyze all pages in an edition directory."""
-    results = {}
-    page_files = sorted(edition_dir.glob("page_*.png"))
+async def _request_page_ads(client: anthropic.AsyncAnthropic, image_path: Path,
+                            clients: list[str] = None,
+                            limiter: RateLimiter = None) -> list[AdInfo]:
+    """Send one single-page request, bypassing the cache and prefilter."""
+    # Encoding is CPU-bound; keep it off the event loop so other pages can proceed
+    image_data = await asyncio.to_thread(encode_image, image_path)
+    request = build_request(image_data, clients)
+    est_tokens = estimate_input_tokens(image_path, build_prompt(clients))
+    response = await create_message(client, request, limiter, est_tokens)
 
-    for page_file in page_files:
-        print(f"Analyzing: {page_file.name}")
+    return ads_from_response(response)
+
+
+async def analyze_batch_async(client: anthropic.AsyncAnthropic, image_paths: list[Path],
+                              clients: list[str] = None,
+                              limiter: RateLimiter = None) -> list[list[AdInfo] | None]:
+    """
+    Analyze several pages in a single request.
+
+    Returns a list aligned with image_paths. An item is None if Claude's
+    reply left that page out. Does not read or write the cache.
+    """
+    images = await asyncio.gather(*(asyncio.to_thread(encode_image, p) for p in image_paths))
+    request = build_batch_request(images, clients)
+    est_tokens = estimate_input_tokens(image_paths, build_prompt(clients))
+    response = await create_message(client, request, limiter, est_tokens)
+
+    return page_ads_from_response(response, len(image_paths))
+
+
+async def analyze_pages_async(image_paths: list[Path], clients: list[str] = None,
+                              max_concurrency: int = MAX_CONCURRENCY,
+                              prefilter: bool = False,
+                              on_result: Callable[[int, object], None] = None,
+                              batch_size: int = PAGES_PER_REQUEST) -> list:
+    """
+    Analyze several pages concurrently, at most max_concurrency requests at a time.
+
+    Pages without a cached result (and not ruled out by the prefilter) are
+    sent batch_size to a request.
+
+    Returns a list aligned with image_paths. Each item is either the page's
+    list of AdInfo or the exception raised while analyzing it. If on_result
+    is given, it is called with (index, item) as each page finishes.
+    """
+    sem = asyncio.Semaphore(max_concurrency)
+    limiter = RateLimiter(REQUESTS_PER_MINUTE, INPUT_TOKENS_PER_MINUTE)
+    batch_size = max(1, batch_size)
+    results = [None] * len(image_paths)
+    # index -> [single-page key, multi-page key], hashed once per page
+    keys = {}
+
+    def finish(index: int, result):
+        results[index] = result
+        if on_result:
+            on_result(index, result)
+
+    def read_cache(index: int) -> list[AdInfo] | None:
+        keys[index] = _page_keys(image_paths[index], clients, prefilter)
+        return _read_ads(keys[index], batched=batch_size > 1)
+
+    def write_cache(index: int, ads: list[AdInfo], batched: bool):
+        _write_ads(keys.get(index), ads, batched)
+
+    async def needs_claude(index: int, image_path: Path) -> bool:
+        """Settle the page from the cache or prefilter if possible."""
         try:
-            ads = analyze_page(page_file, clients)
-            results[page_file.name] = ads
-            print(f"  Found {len(ads)} ads")
-            for ad in ads:
-                print(f"    - {ad.advertiser}: {ad.description[:50]}...")
+            ads = await asyncio.to_thread(read_cache, index)
+            if ads is None and prefilter and not await asyncio.to_thread(likely_has_ads, image_path):
+                ads = []
+                write_cache(index, ads, batched=False)
         except Exception as e:
-            print(f"  Error: {e}")
+            ads = e
+        if ads is None:
+            return True
+        finish(index, ads)
+        return False
+
+    pending = [i for i, needed in enumerate(await asyncio.gather(
+        *(needs_claude(i, p) for i, p in enumerate(image_paths)))) if needed]
+
+    # Retries are handled by create_message so they go through the limiter
+    async with anthropic.AsyncAnthropic(max_retries=0) as client:
+        async def run_page(index: int):
+            async with sem:
+                try:
+                    result = await _request_page_ads(client, image_paths[index], clients, limiter)
+                except Exception as e:
+                    result = e
+            if not isinstance(result, Exception):
+                write_cache(index, result, batched=False)
+            finish(index, result)
+
+        async def run_batch(indexes: list[int]):
+            if len(indexes) == 1:
+                return await run_page(indexes[0])
+
+            paths = [image_paths[i] for i in indexes]
+            async with sem:
+                try:
+                    page_ads = await analyze_batch_async(client, paths, clients, limiter)
+                except Exception as e:
+                    print(f"  Batch request failed ({e.__class__.__name__}), "
+                          f"retrying its {len(indexes)} pages one at a time...")
+                    page_ads = [None] * len(indexes)
+
+            retry = []
+            for index, ads in zip(indexes, page_ads):
+                if ads is None:
+                    retry.append(index)
+                    continue
+                write_cache(index, ads, batched=True)
+                finish(index, ads)
+
+            # Pages missing from the reply, or from a failed request, are
+            # asked about on their own
+            await asyncio.gather(*(run_page(i) for i in retry))
+
+        await asyncio.gather(*(run_batch(pending[i:i + batch_size])
+                               for i in range(0, len(pending), batch_size)))
+
+    return results
+
+
+def analyze_pages(image_paths: list[Path], clients: list[str] = None,
+                  max_concurrency: int = MAX_CONCURRENCY,
+                  prefilter: bool = False,
+                  on_result: Callable[[int, object], None] = None,
+                  batch_size: int = PAGES_PER_REQUEST) -> list:
+    """Synchronous wrapper around analyze_pages_async."""
+    return asyncio.run(analyze_pages_async(image_paths, clients, max_concurrency,
+                                           prefilter, on_result, batch_size))
+
+
+def _ad_info(ad: dict) -> AdInfo:
+    return AdInfo(
+        advertiser=ad["advertiser"],
+        description=ad.get("description", ""),
+        location=ad.get("location", ""),
+        size=ad.get("size", ""),
+        confidence=ad.get("confidence", "medium")
+    )
+
+
+def _tool_input(response, tool: dict) -> dict | None:
+    for block in response.content:
+        if block.type == "tool_use" and block.name == tool["name"]:
+            return block.input
+    return None
+
+
+def ads_from_response(response) -> list[AdInfo]:
+    """Extract AdInfo objects from the record_ads tool call in Claude's response."""
+    tool_input = _tool_input(response, RECORD_ADS_TOOL) or {}
+    return [_ad_info(ad) for ad in tool_input.get("ads", []) if ad.get("advertiser")]
+
+
+def page_ads_from_response(response, page_count: int) -> list[list[AdInfo] | None]:
+    """Split a record_page_ads tool call into per-page AdInfo lists (None if a page is missing)."""
+    pages = [None] * page_count
+    tool_input = _tool_input(response, RECORD_PAGE_ADS_TOOL) or {}
+    for page in tool_input.get("pages", []):
+        index = page.get("page_index")
+        if not isinstance(index, int) or not 0 <= index < page_count:
+            continue
+        # If a page is reported twice, keep the first entry
+        if pages[index] is None:
+            pages[index] = [_ad_info(ad) for ad in page.get("ads", []) if ad.get("advertiser")]
+    return pages
+
+
+async def analyze_edition_async(edition_dir: Path, clients: list[str] = None,
+                                max_concurrency: int = MAX_CONCURRENCY,
+                                prefilter: bool = False) -> dict[str, list[AdInfo]]:
+    """Analyze all pages in an edition directory concurrently."""
+    results = {}
+    page_files = sorted(edition_dir.glob("page_*.png"))
+
+    print(f"Analyzing {len(page_files)} pages ({max_concurrency} requests at a time)...")
+    page_results = await analyze_pages_async(page_files, clients, max_concurrency, prefilter)
+
+    for page_file, ads in zip(page_files, page_results):
+        print(f"Analyzed: {page_file.name}")
+        if isinstance(ads, Exception):
+            print(f"  Error: {ads}")
             results[page_file.name] = []
+            continue
+        results[page_file.name] = ads
+        print(f"  Found {len(ads)} ads")
+        for ad in ads:
+            print(f"    - {ad.advertiser}: {ad.description[:50]}...")
 
     return results
+
+
+def analyze_edition(edition_dir: Path, clients: list[str] = None,
+                    max_concurrency: int = MAX_CONCURRENCY,
+                    prefilter: bool = False) -> dict[str, list[AdInfo]]:
+    """Analyze all pages in an edition directory."""
+    return asyncio.run(analyze_edition_async(edition_dir, clients, max_concurrency, prefilter))
@@ -0,0 +1,75 @@
+"""
+On-disk cache for page analysis results.
+Entries are keyed by a hash of the page image plus whatever else determines
+the result (prompt, model), so unchanged pages are never re-sent to Claude.
+"""
+
+import hashlib
+import time
+from pathlib import Path
+
+from jsonio import load_json, dump_json
+
+CACHE_DIR = Path(".cache/analyzer")
+CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+
+# Turned off by `main.py --no-cache`
+_enabled = True
+
+
+def set_enabled(enabled: bool):
+    """Enable or disable cache reads and writes for this process."""
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled() -> bool:
+    """Whether cache reads and writes are on for this process."""
+    return _enabled
+
+
+def cache_keys(image_path: Path, *part_lists) -> list[str]:
+    """One key per list of parts: SHA-256 of the image bytes followed by each part.
+
+    The image is read and hashed only once however many keys are needed.
+    """
+    image_hash = hashlib.sha256()
+    image_hash.update(image_path.read_bytes())
+    keys = []
+    for parts in part_lists:
+        h = image_hash.copy()
+        for part in parts:
+            h.update(part.encode("utf-8"))
+        keys.append(h.hexdigest())
+    return keys
+
+
+def read(key: str, version: str) -> dict | None:
+    """Return the entry for key, or None if missing, stale, or from another version."""
+    if not _enabled:
+        return None
+
+    path = CACHE_DIR / f"{key}.json"
+    if not path.exists():
+        return None
+    try:
+        entry = load_json(path)
+    except (OSError, ValueError):
+        return None
+
+    if entry.get("version") != version:
+        return None
+    if time.time() - entry.get("created_at", 0) > CACHE_TTL_SECONDS:
+        return None
+    return entry
+
+
+def write(key: str, version: str, entry: dict):
+    """Store entry under key, stamped with version and the current time."""
+    if not _enabled:
+        return
+
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    dump_json({**entry, "version": version, "created_at": time.time()},
+              CACHE_DIR / f"{key}.json")
+
@@ -2,21 +2,27 @@
 Supabase integration for storing ad data and page images.
 """
 
-import io
-import json
+import functools
 import os
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from dotenv import load_dotenv
 from supabase import create_client, Client
-from PIL import Image
+from jsonio import load_json
+import cv2
 
 load_dotenv('.env.local')
 
 BUCKET_NAME = "page-images"
 
+# Pages uploaded in parallel by upload_edition
+UPLOAD_WORKERS = 8
 
+
+@functools.lru_cache(maxsize=1)
 def get_client() -> Client:
-    """Create Supabase client from env vars."""
+    """Create Supabase client from env vars (cached for the process)."""
     url = os.environ["SUPABASE_URL"]
     key = os.environ["SUPABASE_KEY"]
     return create_client(url, key)
@@ -90,81 +96,85 @@ def normalize_advertiser_name(name: str) -> str:
     return name.strip().title()
 
 
-def ensure_advertiser(supabase: Client, name: str) -> int:
-    """Insert or get advertiser record by normalized name. Returns advertiser ID."""
-    normalized = normalize_advertiser_name(name)
-    result = supabase.table("advertisers").select("id").eq("name", normalized).execute()
-    if result.data:
-        return result.data[0]["id"]
+def ensure_advertisers(supabase: Client, names: list[str],
+                       cache: dict[str, int] = None) -> dict[str, int]:
+    """Insert or get advertiser records in bulk. Returns {normalized name: ID}.
+    If cache is given, only names missing from it are queried, and it is
+    updated with the results."""
+    if cache is None:
+        cache = {}
+    normalized = sorted({normalize_advertiser_name(n) for n in names})
+    ids = {name: cache[name] for name in normalized if name in cache}
 
-    result = supabase.table("advertisers").insert({
-        "name": normalized
-    }).execute()
-    return result.data[0]["id"]
+    lookup = [name for name in normalized if name not in ids]
+    if not lookup:
+        return ids
+
+    result = (supabase.table("advertisers")
+              .select("id, name")
+              .in_("name", lookup)
+              .execute())
+    ids.update({row["name"]: row["id"] for row in result.data or []})
+
+    missing = [name for name in lookup if name not in ids]
+    if missing:
+        # Upsert rather than insert: another page being uploaded concurrently
+        # may have created the same advertiser since the SELECT
+        result = supabase.table("advertisers").upsert(
+            [{"name": name} for name in missing], on_conflict="name"
+        ).execute()
+        ids.update({row["name"]: row["id"] for row in result.data})
+
+    cache.update(ids)
+    return ids
 
 
-def update_advertiser_papers(supabase: Client, advertiser_id: int,
+def update_advertiser_papers(supabase: Client, advertiser_ids: list[int],
                              paper_id: int, date_str: str):
-    """Upsert advertiser_papers record. Tracks per-paper ad counts and date range."""
-    result = (supabase.table("advertiser_papers")
-              .select("id, ad_count, first_seen, last_seen")
-              .eq("advertiser_id", advertiser_id)
-              .eq("paper_id", paper_id)
-              .execute())
-    if result.data:
-        row = result.data[0]
-        updates = {"ad_count": (row["ad_count"] or 0) + 1}
-        if not row["first_seen"] or date_str < row["first_seen"]:
-            updates["first_seen"] = date_str
-        if not row["last_seen"] or date_str > row["last_seen"]:
-            updates["last_seen"] = date_str
-        supabase.table("advertiser_papers").update(updates).eq("id", row["id"]).execute()
-    else:
-        supabase.table("advertiser_papers").insert({
-            "advertiser_id": advertiser_id,
-            "paper_id": paper_id,
-            "ad_count": 1,
-            "first_seen": date_str,
-            "last_seen": date_str
-        }).execute()
+    """Upsert advertiser_papers records for a batch of ads (one advertiser ID per ad).
+    Tracks per-paper ad counts and date range in a single round trip."""
+    counts = Counter(advertiser_ids)
+    if not counts:
+        return
+
+    rows = [{
+        "advertiser_id": advertiser_id,
+        "paper_id": paper_id,
+        "ad_count": count,
+        "first_seen": date_str,
+        "last_seen": date_str
+    } for advertiser_id, count in counts.items()]
+    supabase.rpc("upsert_advertiser_papers", {"rows": rows}).execute()
 
 
 def refresh_advertiser_stats(supabase: Client):
-    """Recalculate paper_count and total_ad_count on all advertisers from actual data."""
-    advertisers = supabase.table("advertisers").select("id").execute()
-    for adv in advertisers.data or []:
-        adv_id = adv["id"]
-        # Count distinct papers
-        ap_rows = (supabase.table("advertiser_papers")
-                   .select("paper_id")
-                   .eq("advertiser_id", adv_id)
-                   .execute())
-        paper_count = len(ap_rows.data) if ap_rows.data else 0
-
-        # Count total ads
-        ad_result = (supabase.table("ads")
-                     .select("id", count="exact", head=True)
-                     .eq("advertiser_id", adv_id)
-                     .execute())
-        total_ad_count = ad_result.count or 0
-
-        supabase.table("advertisers").update({
-            "paper_count": paper_count,
-            "total_ad_count": total_ad_count
-        }).eq("id", adv_id).execute()
+    """Recalculate paper_count and total_ad_count on all advertisers from actual data.
+    Runs server-side as two set-based UPDATEs (see supabase/schema.sql)."""
+    supabase.rpc("refresh_advertiser_stats").execute()
 
 
 def insert_ads(supabase: Client, page_id: int, ads: list[dict],
-               paper_id: int = None, date_str: str = None):
+               paper_id: int = None, date_str: str = None,
+               advertiser_cache: dict[str, int] = None):
     """Insert ad records for a page. Clears existing ads for that page first.
-    If paper_id and date_str provided, also links to advertiser entities."""
+    If paper_id and date_str provided, also links to advertiser entities.
+    advertiser_cache (normalized name -> ID) can be shared across calls to
+    skip lookups for advertisers already seen."""
     # Delete existing ads for this page
     supabase.table("ads").delete().eq("page_id", page_id).execute()
 
+    # Resolve every advertiser on the page in one SELECT (+ one INSERT for new ones)
+    advertiser_ids = ensure_advertisers(
+        supabase, [ad["advertiser"] for ad in ads if ad.get("advertiser")],
+        cache=advertiser_cache)
+
+    records = []
     for ad in ads:
+        # Bulk inserts need identical keys on every row, so advertiser_id is always set
         record = {
             "page_id": page_id,
             "advertiser": ad["advertiser"],
+            "advertiser_id": None,
             "description": ad.get("description", ""),
             "location": ad.get("location", ""),
             "size": ad.get("size", ""),
@@ -173,39 +183,64 @@ def insert_ads(supabase: Client, page_id: int, ads: list[dict],
 
         # Link to advertiser entity
         if ad.get("advertiser"):
-            advertiser_id = ensure_advertiser(supabase, ad["advertiser"])
-            record["advertiser_id"] = advertiser_id
+            record["advertiser_id"] = advertiser_ids[normalize_advertiser_name(ad["advertiser"])]
+
+        records.append(record)
 
-            # Update advertiser_papers if we know the paper/date
-            if paper_id and date_str:
-                update_advertiser_papers(supabase, advertiser_id, paper_id, date_str)
+    if records:
+        supabase.table("ads").insert(records).execute()
 
-        supabase.table("ads").insert(record).execute()
+    # Update advertiser_papers if we know the paper/date
+    if paper_id and date_str:
+        update_advertiser_papers(
+            supabase, [r["advertiser_id"] for r in records if r["advertiser_id"]],
+            paper_id, date_str)
 
 
 def upload_page_image(supabase: Client, local_path: Path, storage_path: str):
     """Convert PNG to JPEG and upload to Supabase Storage."""
-    img = Image.open(local_path)
-    if img.mode in ('RGBA', 'P'):
-        img = img.convert('RGB')
-
-    buffer = io.BytesIO()
-    img.save(buffer, format='JPEG', quality=85)
-    jpeg_bytes = buffer.getvalue()
-
-    # Remove existing file if present (upsert)
-    try:
-        supabase.storage.from_(BUCKET_NAME).remove([storage_path])
-    except Exception:
-        pass
-
+    # OpenCV's libpng/libjpeg-turbo path is much faster than Pillow for large
+    # scans, and IMREAD_ANYCOLOR handles RGBA/palette PNGs without a convert step
+    img = cv2.imread(str(local_path), cv2.IMREAD_ANYCOLOR)
+    if img is None:
+        raise ValueError(f"Could not read image: {local_path}")
+
+    ok, buf = cv2.imencode(".jpg", img, [int(cv2.IMWRITE_JPEG_QUALITY), 85])
+    if not ok:
+        raise ValueError(f"JPEG encoding failed: {local_path}")
+    jpeg_bytes = buf.tobytes()
+
+    # x-upsert overwrites any existing object in the same request
     supabase.storage.from_(BUCKET_NAME).upload(
         storage_path,
         jpeg_bytes,
-        file_options={"content-type": "image/jpeg"}
+        file_options={"content-type": "image/jpeg", "x-upsert": "true"}
     )
 
 
+def _upload_one_page(supabase: Client, slug: str, date_str: str, img_path: Path,
+                     section_lookup: dict, edition_id: int,
+                     ads_by_page: dict[int, list[dict]], paper_id: int,
+                     advertiser_cache: dict[str, int]):
+    """Upload one page image, its page record, and its ads."""
+    page_num = int(img_path.stem.replace('page_', ''))
+    section = section_lookup.get(page_num, "Unknown")
+    storage_path = f"{slug}/{date_str}/page_{page_num:03d}.jpg"
+
+    print(f"  Uploading page {page_num}...")
+    upload_page_image(supabase, img_path, storage_path)
+
+    page_id = ensure_page(supabase, edition_id, page_num, section, storage_path)
+
+    # Insert ads for this page
+    page_ads = ads_by_page.get(page_num, ())
+    if page_ads:
+        insert_ads(supabase, page_id, page_ads,
+                   paper_id=paper_id, date_str=date_str,
+                   advertiser_cache=advertiser_cache)
+        print(f"    Page {page_num}: {len(page_ads)} ads")
+
+
 def upload_edition(paper_config: dict, date_str: str, edition_dir: Path,
                    all_ads: list[dict]):
     """Upload an entire edition (pages + ads) to Supabase."""
@@ -222,8 +257,7 @@ def upload_edition(paper_config: dict, date_str: str, edition_dir: Path,
     page_map_path = edition_dir / "page_map.json"
     page_map = []
     if page_map_path.exists():
-        with open(page_map_path) as f:
-            page_map = json.load(f)
+        page_map = load_json(page_map_path)
 
     section_lookup = {p["page_num"]: p["section"] for p in page_map}
 
@@ -235,23 +269,22 @@ def upload_edition(paper_config: dict, date_str: str, edition_dir: Path,
     # Ensure edition
     edition_id = ensure_edition(supabase, paper_id, date_str, page_count, ad_count)
 
-    # Upload pages and images
-    for img_path in page_images:
-        page_num = int(img_path.stem.replace('page_', ''))
-        section = section_lookup.get(page_num, "Unknown")
-        storage_path = f"{slug}/{date_str}/page_{page_num:03d}.jpg"
+    # Bucket ads by page once instead of scanning all_ads for every page
+    ads_by_page = defaultdict(list)
+    for ad in all_ads:
+        ads_by_page[ad.get("page")].append(ad)
 
-        print(f"  Uploading page {page_num}...")
-        upload_page_image(supabase, img_path, storage_path)
+    # Advertiser IDs resolved so far, shared by all pages of this upload
+    advertiser_cache = {}
 
-        page_id = ensure_page(supabase, edition_id, page_num, section, storage_path)
+    # Upload pages and images. Each page is independent, and the work is
+    # almost entirely network waits, so threads overlap the round trips.
+    def upload_one(img_path: Path):
+        _upload_one_page(supabase, slug, date_str, img_path, section_lookup,
+                         edition_id, ads_by_page, paper_id, advertiser_cache)
 
-        # Insert ads for this page
-        page_ads = [a for a in all_ads if a.get("page") == page_num]
-        if page_ads:
-            insert_ads(supabase, page_id, page_ads,
-                       paper_id=paper_id, date_str=date_str)
-            print(f"    {len(page_ads)} ads")
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+        list(executor.map(upload_one, page_images))
 
     # Refresh advertiser aggregate stats
     print("  Refreshing advertiser stats...")
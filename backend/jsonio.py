@@ -0,0 +1,25 @@
+"""
+Fast JSON file helpers backed by orjson.
+"""
+
+import os
+from pathlib import Path
+
+import orjson
+
+
+def load_json(path: Path):
+    """Read and parse a JSON file."""
+    return orjson.loads(Path(path).read_bytes())
+
+
+def dump_json(obj, path: Path):
+    """
+    Write obj to path as indented JSON.
+    Goes through a .tmp sibling and os.replace, so an interrupted run never
+    leaves a truncated file behind.
+    """
+    path = Path(path)
+    tmp = path.with_suffix(path.suffix + '.tmp')
+    tmp.write_bytes(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+    os.replace(tmp, path)
@@ -9,36 +9,49 @@ Usage:
     python main.py --paper ajc --start-date 2026-01-01 --end-date 2026-01-31
     python main.py --paper ajc --date 2026-01-26 --upload
     python main.py --paper ajc --analyze output/ajc/2026-01-26
+    python main.py --paper ajc --analyze output/ajc/2026-01-26 --no-cache
+    python main.py --paper ajc --date 2026-01-26 --prefilter
     python main.py --paper ajc --list-dates
 """
 
 import argparse
 import csv
-import json
+import functools
 from datetime import datetime, timedelta
 from pathlib import Path
 
+from jsonio import load_json, dump_json
 from scraper import PageSuiteScraper
-from analyzer import analyze_page, AdInfo
-from matcher import load_clients
+import analyzer_cache
+from analyzer import analyze_pages, AdInfo, MAX_CONCURRENCY, PAGES_PER_REQUEST
+from matcher import load_clients, clients_lower
 from notify import send_error_email
 
+CSV_HEADER = ('Date', 'Page', 'Section', 'Advertiser', 'Description', 'Size', 'Location', 'Confidence')
 
-def load_paper_configs() -> list[dict]:
-    """Load paper configurations from papers.json."""
+
+@functools.lru_cache(maxsize=1)
+def load_paper_configs() -> tuple[dict, ...]:
+    """Load paper configurations from papers.json.
+
+    Cached for the life of the process; callers must not mutate the dicts.
+    """
     config_path = Path(__file__).parent / "papers.json"
-    with open(config_path) as f:
-        return json.load(f)
+    return tuple(load_json(config_path))
+
+
+@functools.lru_cache(maxsize=1)
+def _paper_configs_by_slug() -> dict[str, dict]:
+    """Paper configs keyed by slug."""
+    return {c["slug"]: c for c in load_paper_configs()}
 
 
 def get_paper_config(slug: str) -> dict:
     """Get config for a specific paper by slug."""
-    configs = load_paper_configs()
-    for config in configs:
-        if config["slug"] == slug:
-            return config
-    available = [c["slug"] for c in configs]
-    raise ValueError(f"Unknown paper '{slug}'. Available: {', '.join(available)}")
+    configs = _paper_configs_by_slug()
+    if slug in configs:
+        return configs[slug]
+    raise ValueError(f"Unknown paper '{slug}'. Available: {', '.join(configs)}")
 
 
 def parse_date(date_str: str) -> datetime:
@@ -54,45 +67,69 @@ def date_range(start: datetime, end: datetime):
         current += timedelta(days=1)
 
 
-def analyze_edition(edition_dir: Path, clients: list[str] = None) -> list[dict]:
+def analyze_edition(edition_dir: Path, clients: list[str] = None,
+                    prefilter: bool = False) -> list[dict]:
     """Analyze all pages in an edition directory."""
     page_map_path = edition_dir / "page_map.json"
     if not page_map_path.exists():
         print(f"No page_map.json found in {edition_dir}")
         return []
 
-    with open(page_map_path) as f:
-        page_map = json.load(f)
-    all_ads = []
-
+    page_map = load_json(page_map_path)
+    pages = []
     for page_info in page_map:
         page_num = page_info['page_num']
-        section = page_info['section']
         img_path = edition_dir / f"page_{page_num:03d}.png"
+        if img_path.exists():
+            pages.append((page_num, page_info['section'], img_path))
+
+    def report(index: int, ads):
+        # Called as each page finishes, so progress streams out of order
+        page_num, section, _ = pages[index]
+        if isinstance(ads, Exception):
+            print(f"  Page {page_num} ({section}): Error: {ads}")
+            return
+        print(f"  Page {page_num} ({section}): {len(ads)} ads")
+        for ad in ads:
+            print(f"    Found: {ad.advertiser} ({ad.size})")
 
-        if not img_path.exists():
-            continue
+    print(f"  Analyzing {len(pages)} pages ({MAX_CONCURRENCY} requests at a time, "
+          f"{PAGES_PER_REQUEST} pages per request)...")
+    results = analyze_pages([img_path for _, _, img_path in pages], clients,
+                            prefilter=prefilter, on_result=report)
 
-        print(f"  Analyzing page {page_num} ({section})...")
-        try:
-            ads = analyze_page(img_path, clients)
-            for ad in ads:
-                all_ads.append({
-                    'page': page_num,
-                    'section': section,
-                    'advertiser': ad.advertiser,
-                    'description': ad.description,
-                    'size': ad.size,
-                    'location': ad.location,
-                    'confidence': ad.confidence
-                })
-                print(f"    Found: {ad.advertiser} ({ad.size})")
-        except Exception as e:
-            print(f"    Error: {e}")
+    all_ads = []
+    for (page_num, section, _), ads in zip(pages, results):
+        if isinstance(ads, Exception):
+            continue
+        for ad in ads:
+            all_ads.append({
+                'page': page_num,
+                'section': section,
+                'advertiser': ad.advertiser,
+                'description': ad.description,
+                'size': ad.size,
+                'location': ad.location,
+                'confidence': ad.confidence
+            })
 
     return all_ads
 
 
+def _csv_row(ad: dict, date_str: str) -> list:
+    """CSV row (matching CSV_HEADER) for one ad."""
+    return [
+        date_str,
+        ad['page'],
+        ad['section'],
+        ad['advertiser'],
+        ad['description'][:200],
+        ad['size'],
+        ad['location'],
+        ad.get('confidence', '')
+    ]
+
+
 def write_csv(ads: list[dict], output_path: Path, date_str: str):
     """Write ads to CSV file."""
     mode = 'a' if output_path.exists() else 'w'
@@ -101,19 +138,8 @@ def write_csv(ads: list[dict], output_path: Path, date_str: str):
     with open(output_path, mode, newline='') as f:
         writer = csv.writer(f)
         if write_header:
-            writer.writerow(['Date', 'Page', 'Section', 'Advertiser', 'Description', 'Size', 'Location', 'Confidence'])
-
-        for ad in ads:
-            writer.writerow([
-                date_str,
-                ad['page'],
-                ad['section'],
-                ad['advertiser'],
-                ad['description'][:200],
-                ad['size'],
-                ad['location'],
-                ad.get('confidence', '')
-            ])
+            writer.writerow(CSV_HEADER)
+        writer.writerows(_csv_row(ad, date_str) for ad in ads)
 
 
 def filter_client_ads(ads: list[dict], clients: list[str]) -> list[dict]:
@@ -122,21 +148,23 @@ def filter_client_ads(ads: list[dict], clients: list[str]) -> list[dict]:
         return ads
 
     matches = []
-    clients_lower = [c.lower() for c in clients]
+    lowered, lowered_set = clients_lower(tuple(clients))
 
     for ad in ads:
         advertiser_lower = ad['advertiser'].lower()
-        for client in clients_lower:
-            if client in advertiser_lower or advertiser_lower in client:
-                matches.append(ad)
-                break
+        # Exact matches (the common case for recurring advertisers) skip the scan
+        if advertiser_lower in lowered_set:
+            matches.append(ad)
+            continue
+        if any(c in advertiser_lower or advertiser_lower in c for c in lowered):
+            matches.append(ad)
 
     return matches
 
 
 def process_date(scraper: PageSuiteScraper, date: datetime,
                  clients: list[str], upload: bool = False,
-                 paper_config: dict = None) -> list[dict]:
+                 paper_config: dict = None, prefilter: bool = False) -> list[dict]:
     """Process a single date: download, analyze, optionally upload."""
     date_str = date.strftime("%Y-%m-%d")
     print(f"\nProcessing {date_str}...")
@@ -149,11 +177,10 @@ def process_date(scraper: PageSuiteScraper, date: datetime,
 
     # Analyze
     edition_dir = scraper.output_dir / date_str
-    ads = analyze_edition(edition_dir, clients)
+    ads = analyze_edition(edition_dir, clients, prefilter=prefilter)
 
     # Save raw results
-    with open(edition_dir / "all_ads.json", 'w') as f:
-        json.dump(ads, f, indent=2)
+    dump_json(ads, edition_dir / "all_ads.json")
 
     # Upload to Supabase if requested
     if upload and paper_config:
@@ -179,9 +206,16 @@ def main():
                         help='List available edition dates')
     parser.add_argument('--upload', action='store_true',
                         help='Upload results to Supabase')
+    parser.add_argument('--prefilter', action='store_true',
+                        help='Skip pages that look text-only without calling Claude')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Re-analyze pages even if cached results exist')
 
     args = parser.parse_args()
 
+    if args.no_cache:
+        analyzer_cache.set_enabled(False)
+
     # Load clients
     clients_path = Path(__file__).parent / "clients.txt"
     clients = load_clients(clients_path)
@@ -226,7 +260,7 @@ def main():
             edition_dir = Path(args.analyze)
             date_str = edition_dir.name
             print(f"Analyzing {edition_dir}...")
-            ads = analyze_edition(edition_dir, clients)
+            ads = analyze_edition(edition_dir, clients, prefilter=args.prefilter)
 
             if args.clients_only:
                 ads = filter_client_ads(ads, clients)
@@ -258,7 +292,8 @@ def main():
             date_str = date.strftime("%Y-%m-%d")
             try:
                 ads = process_date(scraper, date, clients,
-                                  upload=args.upload, paper_config=paper_config)
+                                  upload=args.upload, paper_config=paper_config,
+                                  prefilter=args.prefilter)
                 for ad in ads:
                     ad['date'] = date_str
                 all_ads.extend(ads)
@@ -277,11 +312,11 @@ def main():
 
         # Write output
         if all_ads:
-            if output_path.exists():
-                output_path.unlink()
-
-            for ad in all_ads:
-                write_csv([ad], output_path, ad.get('date', ''))
+            # One file open and writer for the whole run, each row with its own date
+            with open(output_path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(CSV_HEADER)
+                writer.writerows(_csv_row(ad, ad.get('date', '')) for ad in all_ads)
 
             print(f"\nWrote {len(all_ads)} ads to {output_path}")
 
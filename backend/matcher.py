@@ -2,10 +2,13 @@
 Client name matcher for finding ads in OCR text.
 """
 
+import functools
 import re
 from pathlib import Path
 from dataclasses import dataclass
 
+import ahocorasick
+
 
 @dataclass
 class AdMatch:
@@ -33,22 +36,73 @@ def load_clients(clients_file: Path = Path("clients.txt")) -> list[str]:
     return clients
 
 
+@functools.lru_cache(maxsize=8)
+def clients_lower(clients: tuple[str, ...]) -> tuple[tuple[str, ...], frozenset[str]]:
+    """Lowercased client names, in order and as a set, computed once per client list."""
+    lowered = tuple(c.lower() for c in clients)
+    return lowered, frozenset(lowered)
+
+
+@functools.lru_cache(maxsize=8)
+def _client_patterns(clients: tuple[str, ...]) -> tuple[re.Pattern, ...]:
+    """One case-insensitive pattern per client, compiled once per client list."""
+    return tuple(re.compile(re.escape(c), re.IGNORECASE) for c in clients)
+
+
+@functools.lru_cache(maxsize=8)
+def _client_automaton(clients: tuple[str, ...]) -> ahocorasick.Automaton:
+    """Build an Aho-Corasick automaton over the lowercased client names.
+
+    Each word maps to itself; clients differing only in case share it.
+    """
+    automaton = ahocorasick.Automaton()
+    for lowered in clients_lower(clients)[1]:
+        automaton.add_word(lowered, lowered)
+    automaton.make_automaton()
+    return automaton
+
+
 def find_matches(text: str, clients: list[str], context_chars: int = 100) -> list[tuple[str, str, str]]:
     """Find client name matches in text.
 
-    Returns list of (client_name, matched_text, context) tuples.
+    Returns list of (client_name, matched_text, context) tuples, grouped by
+    client in list order, each client's non-overlapping matches in text order.
     """
     matches = []
+    if not clients:
+        return matches
+
+    clients = tuple(clients)
+    text_lower = text.lower()
+    if len(text_lower) == len(text):
+        # One O(len(text)) pass finds every client at once. The automaton
+        # reports every occurrence, overlapping ones included, in text order.
+        starts = {}
+        for end, lowered in _client_automaton(clients).iter(text_lower):
+            starts.setdefault(lowered, []).append(end + 1 - len(lowered))
 
-    for client in clients:
-        pattern = re.compile(re.escape(client), re.IGNORECASE)
+        spans = []
+        for client, lowered in zip(clients, clients_lower(clients)[0]):
+            # Keep the same hits re.finditer would: skip any that overlap
+            # the previous match of this client
+            last_end = 0
+            for start in starts.get(lowered, ()):
+                if start >= last_end:
+                    last_end = start + len(lowered)
+                    spans.append((start, last_end, client))
+    else:
+        # A few Unicode characters change length when lowercased, which would
+        # shift offsets into the original text; scan each client by regex
+        spans = [(m.start(), m.end(), client)
+                 for client, pattern in zip(clients, _client_patterns(clients))
+                 for m in pattern.finditer(text)]
 
-        for match in pattern.finditer(text):
-            matched_text = match.group()
-            start = max(0, match.start() - context_chars)
-            end = min(len(text), match.end() + context_chars)
-            context = text[start:end].replace('\n', ' ').strip()
+    for match_start, match_end, client in spans:
+        matched_text = text[match_start:match_end]
+        start = max(0, match_start - context_chars)
+        end = min(len(text), match_end + context_chars)
+        context = text[start:end].replace('\n', ' ').strip()
 
-            matches.append((client, matched_text, context))
+        matches.append((client, matched_text, context))
 
     return matches
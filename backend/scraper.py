@@ -8,13 +8,20 @@ Two API modes:
   - "replica" (DMN): replica API for edition list → get_image.aspx for page JPEGs
 """
 
-import io
-import json
+import os
+import tempfile
 import zipfile
+import orjson
 import requests
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed, wait)
 from datetime import datetime
 from pathlib import Path
+from typing import IO
 from dotenv import load_dotenv
+from jsonio import load_json, dump_json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 load_dotenv('.env.local')
 
@@ -25,6 +32,47 @@ IMAGE_BASE = "https://edition.pagesuite.com/get_image.aspx"
 # Placeholder GIF size returned by get_image.aspx for non-existent pages
 PLACEHOLDER_MAX_BYTES = 15000
 
+# Replica pages fetched in parallel
+REPLICA_WORKERS = 8
+
+# Sanity bound for the page-count search; no edition is anywhere near this
+MAX_REPLICA_PAGES = 512
+
+# Shared session settings; the pool must cover REPLICA_WORKERS
+HTTP_POOL_SIZE = 32
+HTTP_TIMEOUT = 30
+
+
+def _replica_page_entry(page_num: int) -> dict:
+    """page_map.json entry for an image API page (no section or PDF info)."""
+    return {
+        'page_num': page_num,
+        'section': 'Unknown',
+        'hash': '',
+        'pdf_name': ''
+    }
+
+
+def _render_pdf_to_png(pdf_data: bytes, output_path: Path, dpi: int = 150) -> bool:
+    """Render the first page of a PDF to PNG. Returns False if the PDF had no pages.
+
+    Module-level so ProcessPoolExecutor can pickle it.
+    """
+    # pdfium renders in-process: no pdftoppm fork/exec or temp PPM files per page
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument(pdf_data)
+    try:
+        if len(pdf) == 0:
+            return False
+        image = pdf[0].render(scale=dpi / 72).to_pil()
+    finally:
+        pdf.close()
+
+    # zlib level 1 encodes ~3x faster than the default 6 for ~20% larger files
+    image.save(str(output_path), 'PNG', compress_level=1, optimize=False)
+    return True
+
 
 class PageSuiteScraper:
     def __init__(self, paper_config: dict):
@@ -37,6 +85,18 @@ class PageSuiteScraper:
         self.output_dir = Path(f"output/{self.slug}")
         self.output_dir.mkdir(parents=True, exist_ok=True)
         self.editions_cache = None
+        self._editions_by_date = {}
+
+        # One pooled session for every request so connections (and TLS) are reused
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=HTTP_POOL_SIZE,
+            pool_maxsize=HTTP_POOL_SIZE,
+            max_retries=Retry(total=3, backoff_factor=0.3,
+                              status_forcelist=[502, 503, 504], raise_on_status=False)
+        )
+        self.session.mount('https://', adapter)
+        self.session.headers['User-Agent'] = f"paper-ad-scan {requests.utils.default_user_agent()}"
 
     def get_editions(self, force_refresh: bool = False) -> list[dict]:
         """Fetch list of available editions."""
@@ -50,15 +110,22 @@ class PageSuiteScraper:
         else:
             self.editions_cache = self._get_editions_published()
 
+        # Index by date for find_edition_by_date; first edition listed wins
+        self._editions_by_date = {}
+        for edition_data in self.editions_cache:
+            if edition_data.get('date') and edition_data.get('editions'):
+                self._editions_by_date.setdefault(edition_data['date'],
+                                                  edition_data['editions'][0])
+
         print(f"Found {len(self.editions_cache)} editions")
         return self.editions_cache
 
     def _get_editions_published(self) -> list[dict]:
         """Fetch editions via published.json (AJC style)."""
         url = f"{PUBLISHED_BASE}/{self.account_guid}/{self.pub_guid}/published.json"
-        response = requests.get(url)
+        response = self.session.get(url, timeout=HTTP_TIMEOUT)
         response.raise_for_status()
-        return response.json()
+        return orjson.loads(response.content)
 
     def _get_editions_replica(self) -> list[dict]:
         """Fetch editions via replica API (DMN style)."""
@@ -66,9 +133,9 @@ class PageSuiteScraper:
         headers = {'accept': 'application/json'}
         if self.api_key:
             headers['x-api-key'] = self.api_key
-        response = requests.get(url, headers=headers)
+        response = self.session.get(url, headers=headers, timeout=HTTP_TIMEOUT)
         response.raise_for_status()
-        raw = response.json()
+        raw = orjson.loads(response.content)
 
         # Normalize to same format as published.json
         editions = []
@@ -85,14 +152,8 @@ class PageSuiteScraper:
 
     def find_edition_by_date(self, target_date: datetime) -> dict | None:
         """Find edition for a specific date."""
-        date_str = target_date.strftime("%Y-%m-%d")
-        editions = self.get_editions()
-
-        for edition_data in editions:
-            if edition_data.get('date') == date_str:
-                if edition_data.get('editions'):
-                    return edition_data['editions'][0]
-        return None
+        self.get_editions()
+        return self._editions_by_date.get(target_date.strftime("%Y-%m-%d"))
 
     def download_edition(self, edition: dict, date: datetime) -> Path:
         """Download an edition. Dispatches to the right method based on api_type."""
@@ -106,60 +167,186 @@ class PageSuiteScraper:
         date_str = date.strftime("%Y-%m-%d")
         edition_dir = self.output_dir / date_str
 
-        # Check if already downloaded
-        if edition_dir.exists() and list(edition_dir.glob("page_*.png")):
+        # metadata.json only gets last_page once every page is on disk, so
+        # its presence means the download finished
+        metadata_path = edition_dir / "metadata.json"
+        if metadata_path.exists() and 'last_page' in load_json(metadata_path):
             print(f"Edition {date_str} already downloaded")
             return edition_dir
 
+        # Otherwise resume after the pages a previous run already fetched.
+        # Pages are written in order and atomically, so the highest number on
+        # disk marks the end of a contiguous run of complete pages.
+        existing = [int(p.stem.split('_')[1]) for p in edition_dir.glob("page_*.png")]
+        first_page = max(existing, default=0) + 1
+
         edition_guid = edition.get('editionGuid', '')
         if not edition_guid:
             print(f"No edition GUID for {date_str}")
             return None
 
-        print(f"Downloading {self.name} edition {date_str} (image API)...")
+        if existing:
+            print(f"Resuming {self.name} edition {date_str} from page {first_page} (image API)...")
+        else:
+            print(f"Downloading {self.name} edition {date_str} (image API)...")
         edition_dir.mkdir(parents=True, exist_ok=True)
 
-        # Download pages by probing page numbers until we hit a placeholder
-        page_map = []
-        page_num = 1
-        while True:
-            url = f"{IMAGE_BASE}?eid={edition_guid}&pnum={page_num}&w=1200"
-            response = requests.get(url)
+        # Find the page count with a few HEAD requests when the server allows
+        # it. Otherwise probe page numbers until we hit a placeholder, a
+        # window at a time in parallel; the pool size also caps how hard we
+        # hit PageSuite.
+        page_count = self._find_replica_page_count(edition_guid)
+
+        page_map = [_replica_page_entry(pnum) for pnum in range(1, first_page)]
+        page_num = first_page
+        # Only set once a placeholder or 4xx shows where the edition ends; a
+        # failed request leaves the download to be resumed next run
+        complete = False
+        with ThreadPoolExecutor(max_workers=REPLICA_WORKERS) as executor:
+            while not complete:
+                if page_count is not None:
+                    # Include the page after the HEAD-derived count: it has
+                    # to come back as the placeholder to confirm the count
+                    window = range(page_num, page_count + 2)
+                else:
+                    window = range(page_num, page_num + REPLICA_WORKERS)
+                results = executor.map(
+                    lambda p: self._fetch_replica_page(edition_guid, p), window)
+
+                try:
+                    for pnum, content in zip(window, results):
+                        if content is None:
+                            complete = True
+                            break
+
+                        # Write then rename so an interrupted run can't
+                        # leave a truncated page that resume would skip
+                        output_path = edition_dir / f"page_{pnum:03d}.png"
+                        tmp_path = output_path.with_suffix('.png.tmp')
+                        tmp_path.write_bytes(content)
+                        os.replace(tmp_path, output_path)
+
+                        page_map.append(_replica_page_entry(pnum))
+                        print(f"  Downloaded page {pnum}")
+                        page_num = pnum + 1
+                    else:
+                        if page_count is not None:
+                            # No placeholder where HEAD said the edition ends
+                            print(f"  Page count {page_count} from HEAD was wrong, probing further")
+                            page_count = None
+                except requests.RequestException as e:
+                    print(f"  Failed to fetch page {page_num}: {e}")
+                    break
 
-            if response.status_code != 200:
-                break
+        # Save page map
+        dump_json(page_map, edition_dir / "page_map.json")
+
+        # Save metadata; last_page marks the download as complete
+        if complete:
+            dump_json({'last_page': page_num - 1, **edition}, metadata_path)
+            print(f"  Downloaded {page_num - 1} pages")
+        else:
+            dump_json(edition, metadata_path)
+            print(f"  Download incomplete after {page_num - 1} pages; will resume next run")
+        return edition_dir
 
-            # Placeholder GIF is ~10KB; real pages are much larger
-            if len(response.content) < PLACEHOLDER_MAX_BYTES:
+    def _probe_replica_page(self, edition_guid: str, page_num: int) -> bool | None:
+        """HEAD a replica page. Returns whether it exists, or None if HEAD can't tell."""
+        url = f"{IMAGE_BASE}?eid={edition_guid}&pnum={page_num}&w=1200"
+        try:
+            response = self.session.head(url, timeout=HTTP_TIMEOUT, allow_redirects=True)
+        except requests.RequestException:
+            return None
+
+        # Only a 200 says anything about the page. Anything else (HEAD not
+        # supported, 403/404, a 5xx still failing after retries) leaves it
+        # to the GET probe.
+        if response.status_code != 200:
+            return None
+
+        try:
+            length = int(response.headers['Content-Length'])
+        except (KeyError, ValueError):
+            return None
+        return length >= PLACEHOLDER_MAX_BYTES
+
+    def _find_replica_page_count(self, edition_guid: str) -> int | None:
+        """Find the last real page by exponential probing then binary search.
+
+        Costs O(log N) HEAD requests. Returns None if any HEAD gives no
+        answer, so the caller can probe linearly.
+        """
+        exists = self._probe_replica_page(edition_guid, 1)
+        if exists is None:
+            return None
+        if not exists:
+            return 0
+
+        # Double until we pass the end: page `last` exists, page `past` doesn't
+        last, past = 1, 2
+        while True:
+            if past > MAX_REPLICA_PAGES:
+                return None
+            exists = self._probe_replica_page(edition_guid, past)
+            if exists is None:
+                return None
+            if not exists:
                 break
+            last, past = past, past * 2
+
+        while past - last > 1:
+            mid = (last + past) // 2
+            exists = self._probe_replica_page(edition_guid, mid)
+            if exists is None:
+                return None
+            if exists:
+                last = mid
+            else:
+                past = mid
+        return last
+
+    def _fetch_replica_page(self, edition_guid: str, page_num: int) -> bytes | None:
+        """Fetch one replica page image.
+
+        Returns None past the last page, which PageSuite marks with a
+        placeholder image or an error status such as 404. Raises
+        requests.RequestException for connection errors and for 5xx, 408 and
+        429 responses still failing after retries, so a transient error isn't
+        mistaken for the end of the edition.
+        """
+        url = f"{IMAGE_BASE}?eid={edition_guid}&pnum={page_num}&w=1200"
+        response = self.session.get(url, timeout=HTTP_TIMEOUT)
+
+        if response.status_code >= 500 or response.status_code in (408, 429):
+            response.raise_for_status()
+        if response.status_code != 200:
+            return None
 
-            output_path = edition_dir / f"page_{page_num:03d}.png"
-            output_path.write_bytes(response.content)
+        # Placeholder GIF is ~10KB; real pages are much larger
+        if len(response.content) < PLACEHOLDER_MAX_BYTES:
+            return None
 
-            page_map.append({
-                'page_num': page_num,
-                'section': 'Unknown',
-                'hash': '',
-                'pdf_name': ''
-            })
-            print(f"  Downloaded page {page_num}")
-            page_num += 1
+        return response.content
 
-        # Save page map
-        with open(edition_dir / "page_map.json", 'w') as f:
-            json.dump(page_map, f, indent=2)
+    def _download_zip(self, url: str) -> IO[bytes]:
+        """Stream a ZIP to an anonymous temp file and return it, rewound.
 
-        # Save metadata
-        with open(edition_dir / "metadata.json", 'w') as f:
-            json.dump(edition, f, indent=2)
+        Editions can be 100+ MB, so this avoids holding the whole archive in
+        memory. The file is deleted when closed.
+        """
+        # Don't let the server gzip an already-compressed archive
+        response = self.session.get(url, stream=True, timeout=HTTP_TIMEOUT,
+                                    headers={'Accept-Encoding': 'identity'})
+        response.raise_for_status()
 
-        print(f"  Downloaded {page_num - 1} pages")
-        return edition_dir
+        zip_file = tempfile.TemporaryFile(suffix='.zip')
+        for chunk in response.iter_content(chunk_size=1 << 20):
+            zip_file.write(chunk)
+        zip_file.seek(0)
+        return zip_file
 
     def _download_edition_published(self, edition: dict, date: datetime) -> Path:
         """Download and extract an edition ZIP file (AJC style)."""
-        from pdf2image import convert_from_bytes
-
         date_str = date.strftime("%Y-%m-%d")
         edition_dir = self.output_dir / date_str
 
@@ -174,8 +361,7 @@ class PageSuiteScraper:
             return None
 
         print(f"Downloading {self.name} edition {date_str}...")
-        response = requests.get(zip_url)
-        response.raise_for_status()
+        zip_file = self._download_zip(zip_url)
 
         edition_dir.mkdir(parents=True, exist_ok=True)
 
@@ -184,11 +370,10 @@ class PageSuiteScraper:
         edition_link = edition.get('editionLink')
         if edition_link:
             try:
-                resp = requests.get(edition_link)
+                resp = self.session.get(edition_link, timeout=HTTP_TIMEOUT)
                 resp.raise_for_status()
-                edition_json = resp.json()
-                with open(edition_dir / "edition.json", 'w') as f:
-                    json.dump(edition_json, f, indent=2)
+                edition_json = orjson.loads(resp.content)
+                dump_json(edition_json, edition_dir / "edition.json")
 
                 for i, page in enumerate(edition_json.get('pages', [])):
                     content_url = page.get('contenturl', '')
@@ -201,8 +386,7 @@ class PageSuiteScraper:
                         'hash': hash_name,
                         'pdf_name': content_url
                     })
-                with open(edition_dir / "page_map.json", 'w') as f:
-                    json.dump(page_map, f, indent=2)
+                dump_json(page_map, edition_dir / "page_map.json")
             except Exception as e:
                 print(f"  Could not fetch edition.json: {e}")
 
@@ -210,8 +394,20 @@ class PageSuiteScraper:
         hash_to_page = {p['hash']: p['page_num'] for p in page_map}
         hash_to_section = {p['hash']: p['section'] for p in page_map}
 
-        # Extract ZIP contents
-        with zipfile.ZipFile(io.BytesIO(response.content)) as zf:
+        def report(future, name, page_num, section):
+            try:
+                if future.result():
+                    print(f"  Converted page {page_num} ({section})")
+            except Exception as e:
+                print(f"  Error converting {name}: {e}")
+
+        # Rasterizing is CPU-bound, so spread it across processes. pdfium isn't
+        # thread-safe, which rules out a thread pool. Members are read as
+        # workers free up, so only a couple of PDFs per worker are in memory.
+        workers = os.cpu_count() or 1
+        with zip_file, zipfile.ZipFile(zip_file) as zf, \
+                ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = {}
             for name in zf.namelist():
                 basename = Path(name).name
                 hash_name = basename.rsplit('.', 1)[0]
@@ -219,19 +415,21 @@ class PageSuiteScraper:
                 if name.lower().endswith('.pdf') and hash_name in hash_to_page:
                     page_num = hash_to_page[hash_name]
                     section = hash_to_section.get(hash_name, 'Unknown')
-                    pdf_data = zf.read(name)
-                    try:
-                        images = convert_from_bytes(pdf_data, dpi=150)
-                        if images:
-                            output_path = edition_dir / f"page_{page_num:03d}.png"
-                            images[0].save(str(output_path), 'PNG')
-                            print(f"  Converted page {page_num} ({section})")
-                    except Exception as e:
-                        print(f"  Error converting {name}: {e}")
+                    output_path = edition_dir / f"page_{page_num:03d}.png"
+
+                    if len(pending) >= workers * 2:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            report(future, *pending.pop(future))
+
+                    future = executor.submit(_render_pdf_to_png, zf.read(name), output_path)
+                    pending[future] = (name, page_num, section)
+
+            for future in as_completed(pending):
+                report(future, *pending[future])
 
         # Save metadata
-        with open(edition_dir / "metadata.json", 'w') as f:
-            json.dump(edition, f, indent=2)
+        dump_json(edition, edition_dir / "metadata.json")
 
         return edition_dir
 
@@ -64,6 +64,44 @@ CREATE INDEX idx_ads_advertiser_id ON ads(advertiser_id);
 CREATE INDEX idx_advertiser_papers_advertiser ON advertiser_papers(advertiser_id);
 CREATE INDEX idx_advertiser_papers_paper ON advertiser_papers(paper_id);
 
+-- Batched upsert of per-paper advertiser stats, called from db.update_advertiser_papers.
+-- rows: [{advertiser_id, paper_id, ad_count, first_seen, last_seen}, ...]
+CREATE OR REPLACE FUNCTION upsert_advertiser_papers(rows JSONB)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+  INSERT INTO advertiser_papers (advertiser_id, paper_id, ad_count, first_seen, last_seen)
+  SELECT advertiser_id, paper_id, ad_count, first_seen, last_seen
+  FROM jsonb_to_recordset(rows)
+    AS r(advertiser_id INTEGER, paper_id INTEGER, ad_count INTEGER, first_seen DATE, last_seen DATE)
+  ON CONFLICT (advertiser_id, paper_id) DO UPDATE SET
+    ad_count = COALESCE(advertiser_papers.ad_count, 0) + EXCLUDED.ad_count,
+    first_seen = LEAST(advertiser_papers.first_seen, EXCLUDED.first_seen),
+    last_seen = GREATEST(advertiser_papers.last_seen, EXCLUDED.last_seen);
+$$;
+
+-- Recompute advertiser aggregates, called from db.refresh_advertiser_stats.
+-- Advertisers with no remaining rows are reset to 0.
+CREATE OR REPLACE FUNCTION refresh_advertiser_stats()
+RETURNS VOID
+LANGUAGE sql
+AS $$
+  UPDATE advertisers a SET paper_count = COALESCE(s.pc, 0)
+  FROM advertisers a2
+  LEFT JOIN (SELECT advertiser_id, COUNT(DISTINCT paper_id) AS pc
+             FROM advertiser_papers
+             GROUP BY advertiser_id) s ON s.advertiser_id = a2.id
+  WHERE a.id = a2.id;
+
+  UPDATE advertisers a SET total_ad_count = COALESCE(s.c, 0)
+  FROM advertisers a2
+  LEFT JOIN (SELECT advertiser_id, COUNT(*) AS c
+             FROM ads
+             WHERE advertiser_id IS NOT NULL
+             GROUP BY advertiser_id) s ON s.advertiser_id = a2.id
+  WHERE a.id = a2.id;
+$$;
+
 -- Enable RLS (Row Level Security) with public read access
 ALTER TABLE papers ENABLE ROW LEVEL SECURITY;
 ALTER TABLE editions ENABLE ROW LEVEL SECURITY;